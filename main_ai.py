@@ -1,11 +1,18 @@
 # imports
 import neat.config
+import neat.species
+import neat.math_util
 import pygame
 from pygame.math import Vector2
 from enum import Enum
 import os
 import neat
 import random
+import time
+import multiprocessing
+import json
+from collections import deque
+import numpy as np
 
 HIGHSCORE_SAVE_FILE = "score_ai.txt"
 
@@ -25,6 +32,24 @@ def serialize_highscore(score: int):
 	with open(HIGHSCORE_SAVE_FILE, 'w') as f:
 		f.write(str(score))
 
+HARD_SNAPSHOTS_SAVE_FILE = "snapshots_ai.json"
+
+# saves and loads the hard snapshots of the curriculum mode
+
+def deserialize_snapshots() -> list[dict]:
+	if not os.path.exists(HARD_SNAPSHOTS_SAVE_FILE):
+		return []
+	with open(HARD_SNAPSHOTS_SAVE_FILE, 'r') as f:
+		try:
+			return json.load(f)
+		except:
+			print("Failed to load hard snapshots from file!")
+			return []
+
+def serialize_snapshots(snapshots: list[dict]):
+	with open(HARD_SNAPSHOTS_SAVE_FILE, 'w') as f:
+		json.dump(snapshots, f)
+
 class Pipe:
 	'''
 	Represents one pipe in the world (bottom and top)
@@ -100,10 +125,364 @@ class Player:
 	def draw(self, surface: pygame.Surface):
 		surface.blit(self.image, self.rect)
 
+def load_pipe_assets() -> None:
+	'''
+	Loads the pipe images into Pipe.TOP and Pipe.BOTTOM (only converted if a display exists)
+	'''
+
+	Pipe.TOP = pygame.image.load('assets/toppipe.png')
+	Pipe.BOTTOM = pygame.image.load('assets/bottompipe.png')
+
+	if pygame.display.get_surface() is not None:
+		Pipe.TOP = Pipe.TOP.convert_alpha()
+		Pipe.BOTTOM = Pipe.BOTTOM.convert_alpha()
+
+	Pipe.TOP = pygame.transform.scale_by(Pipe.TOP, 0.25)
+	Pipe.BOTTOM = pygame.transform.scale_by(Pipe.BOTTOM, 0.25)
+
+def load_player_image() -> pygame.Surface:
+	'''
+	Loads the bird image and scales it (only converted if a display exists)
+	'''
+
+	player_img = pygame.image.load("assets/flappybird.png")
+
+	if pygame.display.get_surface() is not None:
+		player_img = player_img.convert_alpha()
+
+	return pygame.transform.scale_by(player_img, 0.1)
+
+class FlappyEnv:
+	'''
+	Headless simulation of the game with a reset()/step(actions) interface.
+	All birds share one pipe ring, the same way a generation shares the world in Game.run.
+
+	An observation is (bird y, gap top, gap bottom, bird velocity). The first three
+	are the inputs the networks in config.txt are built for.
+	'''
+
+	def __init__(self, num_birds: int = 1, seed: int = None) -> None:
+
+		# the env can run without a window, so load the assets it needs itself
+		if Pipe.TOP is None:
+			load_pipe_assets()
+		self.player_img: pygame.Surface = load_player_image()
+
+		self.spawn_pos = Vector2(
+			(Game.SCREENSIZE.x/2)-(self.player_img.get_width()/2),
+			(Game.SCREENSIZE.y/2)-(self.player_img.get_height()/2)
+		)
+
+		self.rng = random.Random(seed)
+		self.num_birds = num_birds
+		self.reset()
+
+	def reset(self, num_birds: int = None) -> list[tuple]:
+
+		if num_birds is not None:
+			self.num_birds = num_birds
+
+		# insert 3 pipes
+		self.pipes: list[Pipe] = [
+			Pipe(Vector2(Game.SCREENSIZE.x, 200)),
+			Pipe(Vector2(Game.SCREENSIZE.x + Pipe.SPACING, 200)),
+			Pipe(Vector2(Game.SCREENSIZE.x + Pipe.SPACING*2, 250)),
+		]
+
+		self.birds: list[Player] = [Player(self.player_img, self.spawn_pos) for _ in range(self.num_birds)]
+		self.dones: list[bool] = [False] * self.num_birds
+
+		# keeps track of the target pipe
+		self.active_pipe_index = 1
+		self.score = 0
+
+		return self.observations()
+
+	def snapshot(self, index: int = None) -> dict:
+		'''
+		Returns the full state of the world as plain python types (can be saved as json).
+		If index is given, only that bird is kept.
+		'''
+
+		birds = [
+			[bird.rect.x, bird.rect.y, bird.velocity.y, done]
+			for bird, done in zip(self.birds, self.dones)
+		]
+		if index is not None:
+			birds = [birds[index]]
+
+		version, internal_state, gauss_next = self.rng.getstate()
+
+		return {
+			"pipes": [[pipe.position.x, pipe.position.y, pipe.active] for pipe in self.pipes],
+			"birds": birds,
+			"active_pipe_index": self.active_pipe_index,
+			"score": self.score,
+			"rng": [version, list(internal_state), gauss_next]
+		}
+
+	def restore(self, snapshot: dict, num_birds: int = None) -> list[tuple]:
+		'''
+		Puts the world back in the state of a snapshot.
+		If num_birds is given, that many birds are spawned in the state of the snapshot's first bird.
+		'''
+
+		self.pipes = []
+		for x, y, active in snapshot["pipes"]:
+			pipe = Pipe(Vector2(x, y))
+			pipe.active = active
+			pipe.move_x(0) # sync the rects with the position
+			self.pipes.append(pipe)
+
+		birds = snapshot["birds"]
+		if num_birds is not None:
+			birds = [birds[0]] * num_birds
+
+		self.num_birds = len(birds)
+		self.birds = []
+		self.dones = []
+		for x, y, velocity, done in birds:
+			bird = Player(self.player_img, Vector2(x, y))
+			bird.velocity.y = velocity
+			self.birds.append(bird)
+			self.dones.append(done)
+
+		self.active_pipe_index = snapshot["active_pipe_index"]
+		self.score = snapshot["score"]
+
+		version, internal_state, gauss_next = snapshot["rng"]
+		self.rng.setstate((version, tuple(internal_state), gauss_next))
+
+		return self.observations()
+
+	def alive_indices(self) -> list[int]:
+		return [index for index, done in enumerate(self.dones) if not done]
+
+	def observe(self, index: int) -> tuple:
+		bird = self.birds[index]
+		pipe = self.pipes[self.active_pipe_index]
+		return (
+			bird.rect.centery,
+			pipe.top_rect.bottom,
+			pipe.bottom_rect.top,
+			bird.velocity.y
+		)
+
+	def observations(self) -> list[tuple]:
+		return [self.observe(index) for index in range(self.num_birds)]
+
+	def step(self, actions, dt: float = None) -> tuple[list[tuple], list[float], list[bool], dict]:
+		'''
+		Advances the world by one frame. actions[i] is whether bird i flaps.
+		Returns (observations, rewards, dones, info), where info holds the events of the frame.
+		'''
+
+		if dt is None:
+			dt = 1 / Game.FPS
+
+		for index in self.alive_indices():
+			if actions[index]:
+				self.birds[index].jump()
+
+		rewards = [0.0] * self.num_birds
+		info = {"scored": False, "hit": [], "fell": []}
+
+		# if a pipe is offscreen, it is assigned to this var
+		dead_pipe = None
+
+		active_pipe_index = 1
+		for pipe in self.pipes:
+
+			pipe.update(dt)
+
+			if pipe.position.x < -pipe.top_rect.width:
+				dead_pipe = pipe
+
+			for index in self.alive_indices():
+				bird = self.birds[index]
+
+				# check if bird passes the pipe
+				if pipe.position.x < bird.rect.x and pipe.active:
+
+					# set pipe to inactive so it can only add to the score once
+					pipe.active = False
+
+					# reward the living birds
+					for alive in self.alive_indices():
+						rewards[alive] += 5
+
+					self.score += 1
+					info["scored"] = True
+					active_pipe_index += 1
+
+				# kill bird if it collides with pipe
+				if bird.rect.colliderect(pipe.bottom_rect) or bird.rect.colliderect(pipe.top_rect):
+					self.dones[index] = True
+					info["hit"].append(index)
+
+				# kill bird if it his the ground
+				elif bird.rect.bottom > Game.SCREENSIZE.y:
+					self.dones[index] = True
+					info["fell"].append(index)
+
+		self.active_pipe_index = min(len(self.pipes)-1, active_pipe_index)
+
+		# remove dead pipe and create a new one in the back
+		if dead_pipe != None:
+			self.pipes.remove(dead_pipe)
+
+			last_pipe_pos = self.pipes[len(self.pipes)-1].position
+
+			self.pipes.append(
+				Pipe(
+					Vector2(
+						last_pipe_pos.x + Pipe.SPACING,
+						self.rng.randint(200, 400)
+					)
+				)
+			)
+
+		for index in self.alive_indices():
+			self.birds[index].update(dt)
+			rewards[index] += 0.1
+
+		return self.observations(), rewards, list(self.dones), info
+
+class VectorFlappyEnv:
+	'''
+	Steps N independent single-bird worlds at once, using the same rules as FlappyEnv.
+	The state is kept in numpy arrays so one step() call advances every world.
+	Finished worlds are reset automatically; the returned observation is then the first of the new episode.
+	'''
+
+	NUM_PIPES = 3
+
+	def __init__(self, num_envs: int, seed: int = None) -> None:
+
+		if Pipe.TOP is None:
+			load_pipe_assets()
+		player_img = load_player_image()
+
+		self.num_envs = num_envs
+		self.rng = np.random.default_rng(seed)
+
+		# geometry taken from the same assets Pipe and Player use
+		self.pipe_width = Pipe.TOP.get_width()
+		self.pipe_height = Pipe.TOP.get_height()
+		self.bird_width = player_img.get_width()
+		self.bird_height = player_img.get_height()
+		self.bird_x = int((Game.SCREENSIZE.x/2)-(self.bird_width/2))
+		self.spawn_y = int((Game.SCREENSIZE.y/2)-(self.bird_height/2))
+
+		self.bird_y = np.zeros(num_envs)
+		self.velocity = np.zeros(num_envs)
+		self.pipe_x = np.zeros((num_envs, VectorFlappyEnv.NUM_PIPES))
+		self.pipe_y = np.zeros((num_envs, VectorFlappyEnv.NUM_PIPES))
+		self.pipe_active = np.zeros((num_envs, VectorFlappyEnv.NUM_PIPES), dtype=bool)
+		self.active_pipe_index = np.ones(num_envs, dtype=np.int64)
+		self.scores = np.zeros(num_envs, dtype=np.int64)
+
+		self.reset()
+
+	def _reset_envs(self, mask: np.ndarray) -> None:
+		self.bird_y[mask] = self.spawn_y
+		self.velocity[mask] = 0
+		self.pipe_x[mask] = Game.SCREENSIZE.x + Pipe.SPACING * np.arange(VectorFlappyEnv.NUM_PIPES)
+		self.pipe_y[mask] = (200, 200, 250)
+		self.pipe_active[mask] = True
+		self.active_pipe_index[mask] = 1
+		self.scores[mask] = 0
+
+	def reset(self) -> np.ndarray:
+		self._reset_envs(np.ones(self.num_envs, dtype=bool))
+		return self.observations()
+
+	def observations(self) -> np.ndarray:
+		rows = np.arange(self.num_envs)
+		target_y = self.pipe_y[rows, self.active_pipe_index]
+		return np.stack((
+			self.bird_y + self.bird_height // 2,
+			target_y - Pipe.GAPSIZE // 2,
+			target_y + Pipe.GAPSIZE // 2,
+			self.velocity
+		), axis=1)
+
+	def step(self, actions, dt: float = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+		'''
+		Advances every world by one frame. actions is a boolean array of shape (num_envs,).
+		Returns (observations, rewards, dones) as arrays of shape (num_envs, 4), (num_envs,), (num_envs,).
+		'''
+
+		if dt is None:
+			dt = 1 / Game.FPS
+
+		actions = np.asarray(actions, dtype=bool)
+		self.velocity[actions] = -Player.JUMPPOWER
+
+		# move the pipes (rects are integers, like pygame.Rect)
+		self.pipe_x -= Pipe.SPEED*dt
+		pipe_rect_x = np.trunc(self.pipe_x)
+
+		# check if birds pass the pipes
+		passed = self.pipe_active & (self.pipe_x < self.bird_x)
+		num_passed = passed.sum(axis=1)
+		self.pipe_active &= ~passed
+		self.scores += num_passed
+		rewards = 5.0 * num_passed
+		self.active_pipe_index = np.minimum(VectorFlappyEnv.NUM_PIPES-1, 1 + num_passed)
+
+		# kill birds that collide with a pipe or hit the ground
+		bird_y = self.bird_y[:, None]
+		overlap_x = (pipe_rect_x < self.bird_x + self.bird_width) & (self.bird_x < pipe_rect_x + self.pipe_width)
+		gap_top = self.pipe_y - Pipe.GAPSIZE // 2
+		gap_bottom = self.pipe_y + Pipe.GAPSIZE // 2
+		hit_top = (gap_top - self.pipe_height < bird_y + self.bird_height) & (bird_y < gap_top)
+		hit_bottom = (gap_bottom < bird_y + self.bird_height) & (bird_y < gap_bottom + self.pipe_height)
+		hit = (overlap_x & (hit_top | hit_bottom)).any(axis=1)
+		fell = self.bird_y + self.bird_height > Game.SCREENSIZE.y
+		dones = hit | fell
+
+		# remove offscreen pipes and create new ones in the back
+		dead = self.pipe_x[:, 0] < -self.pipe_width
+		if dead.any():
+			self.pipe_x[dead] = np.roll(self.pipe_x[dead], -1, axis=1)
+			self.pipe_y[dead] = np.roll(self.pipe_y[dead], -1, axis=1)
+			self.pipe_active[dead] = np.roll(self.pipe_active[dead], -1, axis=1)
+			self.pipe_x[dead, -1] = self.pipe_x[dead, -2] + Pipe.SPACING
+			self.pipe_y[dead, -1] = self.rng.integers(200, 401, size=dead.sum())
+			self.pipe_active[dead, -1] = True
+
+		# applying gravity (with a max of TVEL) to the surviving birds
+		alive = ~dones
+		self.velocity[alive] += Player.GRAVITY
+		np.clip(self.velocity, -Player.TVEL, Player.TVEL, out=self.velocity)
+		self.bird_y[alive] = np.maximum(0, np.trunc(self.bird_y[alive] + self.velocity[alive]*dt))
+		rewards[alive] += 0.1
+
+		if dones.any():
+			self._reset_envs(dones)
+
+		return self.observations(), rewards, dones
+
 class Game:
 
 	SCREENSIZE: Vector2 = Vector2(360, 640)
 	FPS = 60
+	# number of frames between two flap decisions of a bird. Birds are staggered by index,
+	# so only 1/DECISION_INTERVAL of the networks are activated on any given frame
+	DECISION_INTERVAL = 1
+
+	# curriculum mode: instead of flying from the start, generations are evaluated on
+	# HARD_SNAPSHOTS_PER_GENERATION segments of SEGMENT_FRAMES frames, started from snapshots
+	# taken REWIND_FRAMES before birds of previous generations died. Every FULL_RUN_INTERVAL-th
+	# generation is a normal full run instead, so the snapshots keep coming from real deaths
+	CURRICULUM = False
+	FULL_RUN_INTERVAL = 3
+	HARD_SNAPSHOTS_PER_GENERATION = 5
+	MAX_HARD_SNAPSHOTS = 200
+	SEGMENT_FRAMES = 300
+	SNAPSHOT_INTERVAL = 30
+	REWIND_FRAMES = 90
 	FONT: pygame.font.Font = None
 	FONTLG = None
 
@@ -144,7 +523,6 @@ class Game:
 		self.debug = False
 		self.muted = False
 
-		self.score: int = 0
 		self.high_score: int = deserialize_highscore()
 
 		# initialize the fonts and the game state
@@ -155,29 +533,35 @@ class Game:
 		self.bg_img: pygame.Surface = pygame.image.load("assets/flappybirdbg.png").convert()
 
 		# load pipe assets
-		Pipe.TOP = pygame.image.load('assets/toppipe.png').convert_alpha()
-		Pipe.BOTTOM = pygame.image.load('assets/bottompipe.png').convert_alpha()
+		load_pipe_assets()
+
+		# the simulation of the world, drawn by the game
+		self.env = FlappyEnv()
 
-		Pipe.TOP = pygame.transform.scale_by(Pipe.TOP, 0.25)
-		Pipe.BOTTOM = pygame.transform.scale_by(Pipe.BOTTOM, 0.25)
+		# library of snapshots where birds died, for the curriculum mode
+		self.hard_snapshots: deque[dict] = deque(deserialize_snapshots(), maxlen=Game.MAX_HARD_SNAPSHOTS)
+		self.hard_snapshots_changed = False
+
+		# throughput stats for the generation report
+		self.frames = 0
+		self.activations = 0
+		self.activation_time = 0.0
 
 		# setup the game
 		self.setup()
 
-	def setup(self):
-
-		# empty the list of pipes
-		self.pipes: list[Pipe] = []
+	@property
+	def score(self) -> int:
+		return self.env.score
 
-		# insert 3 pipes
-		self.pipes.append(Pipe(Vector2(Game.SCREENSIZE.x, 200)))
-		self.pipes.append(Pipe(Vector2(Game.SCREENSIZE.x + Pipe.SPACING, 200)))
-		self.pipes.append(Pipe(Vector2(Game.SCREENSIZE.x + Pipe.SPACING*2, 250)))
+	@property
+	def pipes(self) -> list[Pipe]:
+		return self.env.pipes
 
-		self.high_score = max(self.high_score, self.score)
+	def setup(self, num_birds: int = 1):
 
-		# reset the score
-		self.score = 0
+		# reset the pipes, birds and score (run() keeps the high score)
+		self.env.reset(num_birds)
 
 	def run(self, genomes, config) -> None:
 
@@ -188,27 +572,97 @@ class Game:
 
 		self.generation += 1
 
-		# load the player image and scale it
-		player_img = pygame.image.load("assets/flappybird.png").convert_alpha()
-		player_img = pygame.transform.scale_by(player_img, 0.1)
-
-		player_spawn_pos = Vector2((Game.SCREENSIZE.x/2)-(player_img.get_width()/2), (Game.SCREENSIZE.y/2)-(player_img.get_height()/2))
-
-		# create parallel lists to keep track of the birds and their respective networks + genomes
+		# create parallel lists to keep track of the networks + genomes (index i is bird i of the env)
 		networks = []
 		ges = []
-		birds: list[Player] = []
 
-		# loop over genomes and init birds
+		# loop over genomes and init networks
 		for id, genome in genomes:
 			genome.fitness = 0 # set the init fitness level
 			network = neat.nn.FeedForwardNetwork.create(genome, config)
 			networks.append(network)
-			birds.append(Player(player_img, player_spawn_pos))
 			ges.append(genome)
 
+		# throughput stats for the generation report
+		self.frames = 0
+		self.activations = 0
+		self.activation_time = 0.0
+		start_time = time.perf_counter()
+
+		# only full runs count for the high score, a segment starts at its snapshot's score
+		best_score = 0
+
+		if Game.FULL_RUN_INTERVAL < 1:
+			raise ValueError(f"Game.FULL_RUN_INTERVAL must be at least 1, got {Game.FULL_RUN_INTERVAL}")
+
+		full_run = (
+			not Game.CURRICULUM
+			or len(self.hard_snapshots) == 0
+			or self.generation % Game.FULL_RUN_INTERVAL == 0
+		)
+
+		if full_run:
+
+			# spawn one bird per genome in a fresh world
+			self.setup(len(ges))
+			self.play_episode(networks, ges)
+			best_score = self.score
+
+		else:
+
+			# every bird flies the same hard segments, fitness is the average over them
+			num_segments = min(Game.HARD_SNAPSHOTS_PER_GENERATION, len(self.hard_snapshots))
+			for snapshot in random.sample(list(self.hard_snapshots), num_segments):
+				self.env.restore(snapshot, len(ges))
+				self.play_episode(networks, ges, Game.SEGMENT_FRAMES)
+
+			for genome in ges:
+				genome.fitness /= num_segments
+
+			# a genome can only win (reach fitness_threshold) on a full run, so the ones
+			# that reach it on segments are scored again from the start
+			indices = [index for index, genome in enumerate(ges) if genome.fitness >= config.fitness_threshold]
+			if len(indices) > 0:
+				for index in indices:
+					ges[index].fitness = 0
+
+				self.setup(len(indices))
+				self.play_episode([networks[index] for index in indices], [ges[index] for index in indices])
+				best_score = self.score
+
+		elapsed = time.perf_counter() - start_time
+		if self.frames > 0 and elapsed > 0:
+			print(
+				f"Generation {self.generation}: {self.frames} frames in {elapsed:.2f}s ({self.frames/elapsed:.0f} frames/s), "
+				f"{self.activations} activations ({self.activations/self.frames:.1f} per frame, {self.activation_time:.2f}s), "
+				f"decision interval {Game.DECISION_INTERVAL}, {len(self.hard_snapshots)} hard snapshots"
+			)
+
+		if best_score > self.high_score:
+			serialize_highscore(best_score)
+			self.high_score = best_score
+
+	def play_episode(self, networks, ges, max_frames: int = None) -> None:
+		'''
+		Plays the env from its current state until every bird is dead (or max_frames have passed).
+		In curriculum mode, deaths are added to the hard snapshots, rewound by REWIND_FRAMES.
+		'''
+
+		if Game.DECISION_INTERVAL < 1:
+			raise ValueError(f"Game.DECISION_INTERVAL must be at least 1, got {Game.DECISION_INTERVAL}")
+
+		observations = self.env.observations()
+		frame = 0
+
+		# recent snapshots of the world, as (frame, snapshot)
+		history: deque[tuple[int, dict]] = deque(maxlen=Game.REWIND_FRAMES // Game.SNAPSHOT_INTERVAL + 2)
+		recorded_frames = set()
+
 		# game loop
-		while self.running and len(birds) > 0:
+		while self.running and len(self.env.alive_indices()) > 0 and (max_frames is None or frame < max_frames):
+
+			if Game.CURRICULUM and frame % Game.SNAPSHOT_INTERVAL == 0:
+				history.append((frame, self.env.snapshot()))
 
 			# set a target fps
 			dt: float = self.clock.tick(Game.FPS) / 1000.0
@@ -234,67 +688,62 @@ class Game:
 							for sound in self.sounds:
 								sound.set_volume(0)
 						self.muted = not self.muted
-						
 
-			# draw the background
-			self.screen.blit(self.bg_img, (0,0))
-			
-			# if a pipe is offscreen, it is assigned to this var
-			dead_pipe = None
-			
-			# keeps track of the target pipe
-			active_pipe_index = 1
-			for pipe in self.pipes:
+			# ask the living birds whose turn it is whether to flap. A flap is an impulse,
+			# so the frames in between a bird's decisions are played without flapping
+			actions = [False] * len(ges)
+			for index in self.env.alive_indices():
+				if (frame + index) % Game.DECISION_INTERVAL != 0:
+					continue
 
-				# update the pipe
-				pipe.update(dt)
+				self.activations += 1
 
-				# if pipe is offscreen
-				if pipe.position.x < -pipe.top_rect.width:
-					dead_pipe = pipe
+				# sending bird's position, bottom of the top pipe and top of the bottom pipe
+				activation_start = time.perf_counter()
+				output = networks[index].activate(observations[index][:3])
+				self.activation_time += time.perf_counter() - activation_start
 
-				kill_list = []
+				# if output reaches threshold (intelligently placed at 0.5)
+				if output[0] > 0.5:
+					actions[index] = True
+					self.sfx_jump.play()
+
+			observations, rewards, dones, info = self.env.step(actions, dt)
+			frame += 1
+			self.frames += 1
+
+			# reward the genomes
+			for index, reward in enumerate(rewards):
+				ges[index].fitness += reward
+
+			if info["scored"]:
+				self.sfx_score.play()
+				print(f"Score: {self.score}")
+
+			for index in info["hit"]:
+				self.sfx_hit.play()
+			for index in info["fell"]:
+				self.sfx_die.play()
+			for index in info["hit"] + info["fell"]:
+				print(f"Bird died. {len(self.env.alive_indices())} left")
+
+				# save the world from a bit before the death (once per snapshot). A restored segment's
+				# first snapshot can be the library entry it came from, so the library is kept free of copies
+				for snapshot_frame, snapshot in reversed(history):
+					if snapshot_frame <= frame - Game.REWIND_FRAMES:
+						if snapshot_frame not in recorded_frames and not snapshot["birds"][index][3]:
+							recorded_frames.add(snapshot_frame)
+							hard_snapshot = {**snapshot, "birds": [snapshot["birds"][index]]}
+							if hard_snapshot not in self.hard_snapshots:
+								self.hard_snapshots.append(hard_snapshot)
+								self.hard_snapshots_changed = True
+						break
+
+			# draw the background
+			self.screen.blit(self.bg_img, (0,0))
+
+			for pipe in self.pipes:
 
-				# check if birds passed the pipe
-				for bird in birds:
-					# check if bird passes the pipe
-					if pipe.position.x < bird.rect.x and pipe.active:
-
-						# if it does, add to the score
-						if pipe.active:
-							# set pipe to inactive so it can only add to the score once
-							pipe.active = False
-
-							# reward the birds
-							for gen in ges:
-								gen.fitness += 5
-							
-							self.sfx_score.play()
-							self.score += 1
-							print(f"Score: {self.score}")
-
-						active_pipe_index += 1
-						
-
-					# kill bird if it collides with pipe
-					if bird.rect.colliderect(pipe.bottom_rect) or bird.rect.colliderect(pipe.top_rect):
-						kill_list.append(bird)
-						self.sfx_hit.play()
-
-					# kill bird if it his the ground
-					elif bird.rect.bottom > Game.SCREENSIZE.y:
-						kill_list.append(bird)
-						self.sfx_die.play()
-
-				# free all birds from kill_list
-				for bird in kill_list:
-					
-					print(f"Bird died. {len(birds)} left")
-
-					networks.pop(birds.index(bird))
-					ges.pop(birds.index(bird))
-					birds.remove(bird)
-					
 				# draw the pipe
 				pipe.draw(self.screen)
 
@@ -332,40 +781,9 @@ class Game:
 						),
 						2
 					)
-			active_pipe_index = min(len(self.pipes)-1, active_pipe_index)
-
-			# remove dead pipe and create a new one in the back
-			if dead_pipe != None:
-				self.pipes.remove(dead_pipe)
-
-				last_pipe_pos = self.pipes[len(self.pipes)-1].position
-
-				self.pipes.append(
-					Pipe(
-						Vector2(
-							last_pipe_pos.x + Pipe.SPACING,
-							random.randint(200, 400)
-					  	)
-					)
-				)
-			
-			for index, bird in enumerate(birds):
-				bird.update(dt)
-
-				ges[index].fitness += 0.1
-
-				# sending bird's position, bottom of the top pipe
-				output = networks[birds.index(bird)].activate((
-					(bird.rect.centery),
-					self.pipes[active_pipe_index].top_rect.bottom,
-					self.pipes[active_pipe_index].bottom_rect.top
-				))
-
-				# if output reaches threshold (intelligently placed at 0.5)
-				if output[0] > 0.5:
-					bird.jump()
-					self.sfx_jump.play()
 
+			birds: list[Player] = [self.env.birds[index] for index in self.env.alive_indices()]
+			for bird in birds:
 				bird.draw(self.screen)
 
 			if self.debug:
@@ -375,13 +793,13 @@ class Game:
 					pygame.draw.rect(
 						self.screen,
 						"red",
-						self.pipes[active_pipe_index].top_rect,
+						self.pipes[self.env.active_pipe_index].top_rect,
 						6
 					)
 					pygame.draw.rect(
 						self.screen,
 						"red",
-						self.pipes[active_pipe_index].bottom_rect,
+						self.pipes[self.env.active_pipe_index].bottom_rect,
 						6
 					)
 
@@ -421,14 +839,271 @@ class Game:
 
 			# update the display
 			pygame.display.update()
-		
-		if self.score > self.high_score:
-			serialize_highscore(self.score)
-		self.score = 0
 
 	def close(self):
+
+		# the library is only saved for the curriculum mode
+		if Game.CURRICULUM and self.hard_snapshots_changed:
+			serialize_snapshots(list(self.hard_snapshots))
 		pygame.quit()
 
+# distance computations for the worker pool of CachedSpeciesSet
+_worker_genome_config = None
+
+def _init_distance_worker(genome_config) -> None:
+	global _worker_genome_config
+	_worker_genome_config = genome_config
+
+def _genome_distances(task) -> list[list[float]]:
+	# distances from every representative to every genome of the chunk
+	representatives, genomes = task
+	return [[rep.distance(g, _worker_genome_config) for g in genomes] for rep in representatives]
+
+class DistanceCache:
+	'''
+	Genetic distances between genomes, kept across generations.
+	An entry is dropped when one of its genomes changes (checked with a fingerprint of its genes),
+	leaves the population, or belongs to the oldest genome when the cache is over max_entries.
+	'''
+
+	def __init__(self, genome_config, max_entries: int) -> None:
+		self.genome_config = genome_config
+		self.max_entries = max_entries
+
+		# distances[a][b] is a.distance(b). Not mirrored, since the float result depends on the order
+		self.distances: dict[int, dict[int, float]] = {}
+		self.fingerprints: dict[int, int] = {}
+		self.size = 0
+
+		self.hits = 0
+		self.misses = 0
+
+	@staticmethod
+	def fingerprint(genome) -> int:
+		return hash((
+			tuple((key, gene.weight, gene.enabled) for key, gene in genome.connections.items()),
+			tuple((key, gene.bias, gene.response, gene.activation, gene.aggregation) for key, gene in genome.nodes.items())
+		))
+
+	def validate(self, genomes) -> None:
+		# drop the distances of genomes that were mutated since they were cached
+		changed = set()
+		for genome in genomes:
+			fingerprint = DistanceCache.fingerprint(genome)
+			old = self.fingerprints.get(genome.key)
+			if old is not None and old != fingerprint:
+				changed.add(genome.key)
+			self.fingerprints[genome.key] = fingerprint
+
+		if changed:
+			self._drop(changed)
+
+	def prune(self, keep) -> None:
+		# drop every genome that isn't in keep
+		self._drop([gid for gid in self.fingerprints if gid not in keep])
+
+	def _drop(self, gids) -> None:
+		gids = set(gids)
+		for gid in gids:
+			self.size -= len(self.distances.pop(gid, {}))
+			self.fingerprints.pop(gid, None)
+
+		for row in self.distances.values():
+			for gid in gids.intersection(row):
+				del row[gid]
+				self.size -= 1
+
+	def get(self, genome0, genome1) -> float:
+		row = self.distances.get(genome0.key)
+		return None if row is None else row.get(genome1.key)
+
+	def put(self, genome0, genome1, d: float) -> None:
+
+		# free the oldest genome's distances when full
+		while self.size >= self.max_entries and self.distances:
+			self.size -= len(self.distances.pop(next(iter(self.distances))))
+
+		row = self.distances.setdefault(genome0.key, {})
+		if genome1.key not in row:
+			self.size += 1
+		row[genome1.key] = d
+
+	def prefetch(self, representatives, genomes, pool, num_workers: int) -> None:
+		# computes the missing distances from the representatives to the genomes in the worker pool
+		genomes = [g for g in genomes if any(self.get(rep, g) is None for rep in representatives)]
+		if not representatives or not genomes:
+			return
+
+		chunksize = max(1, len(genomes) // (num_workers*4))
+		chunks = [genomes[i:i+chunksize] for i in range(0, len(genomes), chunksize)]
+		for chunk, result in zip(chunks, pool.map(_genome_distances, [(representatives, chunk) for chunk in chunks])):
+			for rep, row in zip(representatives, result):
+				for g, d in zip(chunk, row):
+					if self.get(rep, g) is None:
+						self.put(rep, g, d)
+						self.misses += 1
+
+	def __call__(self, genome0, genome1) -> float:
+		d = self.get(genome0, genome1)
+		if d is None:
+			d = genome0.distance(genome1, self.genome_config)
+			self.put(genome0, genome1, d)
+			self.misses += 1
+		else:
+			self.hits += 1
+		return d
+
+class CachedSpeciesSet(neat.DefaultSpeciesSet):
+	'''
+	DefaultSpeciesSet that keeps genome distances across generations and reports the speciation time.
+	With num_workers > 1 the missing distances are computed in a worker pool.
+
+	Opt-in: it gives the same species as DefaultSpeciesSet but was measured a little slower at
+	pop_size 20 to 1000, since children always get new keys and only about 10% of the distances
+	carry over while every genome is fingerprinted each generation. To use it, pass it to
+	neat.config.Config in run() and rename [DefaultSpeciesSet] in config.txt to [CachedSpeciesSet]
+	(optionally with max_cached_distances and num_workers).
+	'''
+
+	def __init__(self, config, reporters) -> None:
+		super().__init__(config, reporters)
+		self.distance_cache: DistanceCache = None
+		self.pool = None
+
+	@classmethod
+	def parse_config(cls, param_dict):
+		return neat.config.DefaultClassConfig(param_dict, [
+			neat.config.ConfigParameter('compatibility_threshold', float),
+			neat.config.ConfigParameter('max_cached_distances', int, 100000),
+			neat.config.ConfigParameter('num_workers', int, 0)
+		])
+
+	def speciate(self, config, population, generation) -> None:
+
+		start_time = time.perf_counter()
+
+		compatibility_threshold = self.species_set_config.compatibility_threshold
+
+		if self.distance_cache is None:
+			self.distance_cache = DistanceCache(config.genome_config, self.species_set_config.max_cached_distances)
+		if self.pool is None and self.species_set_config.num_workers > 1:
+			self.pool = multiprocessing.Pool(
+				self.species_set_config.num_workers,
+				initializer=_init_distance_worker,
+				initargs=(config.genome_config,)
+			)
+
+		cache = self.distance_cache
+		cache.hits = 0
+		cache.misses = 0
+		cache.validate(population.values())
+		cache.validate(s.representative for s in self.species.values())
+
+		# the distances used this generation. Like neat's GenomeDistanceCache, a pair
+		# asked for in both orders gets the same value within a generation
+		used = {}
+		def distance(genome0, genome1) -> float:
+			d = used.get((genome1.key, genome0.key))
+			if d is None:
+				d = cache(genome0, genome1)
+				used[genome0.key, genome1.key] = d
+			return d
+
+		# Find the best representatives for each existing species.
+		unspeciated = set(population.keys())
+		if self.pool is not None:
+			cache.prefetch(
+				[s.representative for s in self.species.values()],
+				list(population.values()),
+				self.pool,
+				self.species_set_config.num_workers
+			)
+
+		new_representatives = {}
+		new_members = {}
+		for sid, s in self.species.items():
+			candidates = []
+			for gid in unspeciated:
+				g = population[gid]
+				d = distance(s.representative, g)
+				candidates.append((d, g))
+
+			# The new representative is the genome closest to the current representative.
+			ignored_rdist, new_rep = min(candidates, key=lambda x: x[0])
+			new_rid = new_rep.key
+			new_representatives[sid] = new_rid
+			new_members[sid] = [new_rid]
+			unspeciated.remove(new_rid)
+
+		# Partition population into species based on genetic similarity.
+		if self.pool is not None:
+			cache.prefetch(
+				[population[rid] for rid in new_representatives.values()],
+				[population[gid] for gid in unspeciated],
+				self.pool,
+				self.species_set_config.num_workers
+			)
+
+		while unspeciated:
+			gid = unspeciated.pop()
+			g = population[gid]
+
+			# Find the species with the most similar representative.
+			candidates = []
+			for sid, rid in new_representatives.items():
+				rep = population[rid]
+				d = distance(rep, g)
+				if d < compatibility_threshold:
+					candidates.append((d, sid))
+
+			if candidates:
+				ignored_sdist, sid = min(candidates, key=lambda x: x[0])
+				new_members[sid].append(gid)
+			else:
+				# No species is similar enough, create a new species, using
+				# this genome as its representative.
+				sid = next(self.indexer)
+				new_representatives[sid] = gid
+				new_members[sid] = [gid]
+
+		# Update species collection based on new speciation.
+		self.genome_to_species = {}
+		for sid, rid in new_representatives.items():
+			s = self.species.get(sid)
+			if s is None:
+				s = neat.species.Species(sid, generation)
+				self.species[sid] = s
+
+			members = new_members[sid]
+			for gid in members:
+				self.genome_to_species[gid] = sid
+
+			member_dict = dict((gid, population[gid]) for gid in members)
+			s.update(population[rid], member_dict)
+
+		# the new representatives all come from the population, so nothing else can be asked for again
+		cache.prune(population)
+
+		gdmean = neat.math_util.mean(used.values())
+		gdstdev = neat.math_util.stdev(used.values())
+		self.reporters.info(
+			'Mean genetic distance {0:.3f}, standard deviation {1:.3f}'.format(gdmean, gdstdev))
+		self.reporters.info(
+			'Speciation took {0:.4f}s ({1} cached, {2} computed distances, {3} in cache)'.format(
+				time.perf_counter() - start_time, cache.hits, cache.misses, cache.size))
+
+	def close(self) -> None:
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+
+	def __getstate__(self):
+		# the worker pool can't be pickled (for neat.Checkpointer)
+		state = self.__dict__.copy()
+		state['pool'] = None
+		return state
+
 NUM_GENERATIONS = 100
 
 def run(config_path: str) -> None:
@@ -450,9 +1125,14 @@ def run(config_path: str) -> None:
 	population.add_reporter(neat.StatisticsReporter())
 
 	game = Game()
-	winner = population.run(game.run, NUM_GENERATIONS)
-
-	game.close()	
+	try:
+		winner = population.run(game.run, NUM_GENERATIONS)
+	finally:
+		# close the game and the speciation worker pool (CachedSpeciesSet), even on complete extinction
+		game.close()
+		close_species = getattr(population.species, "close", None)
+		if close_species is not None:
+			close_species()
 
 	print(f"Winner of the round: {winner}")
 